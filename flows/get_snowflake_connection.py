@@ -2,7 +2,14 @@ from prefect import get_run_logger
 from prefect_snowflake import SnowflakeCredentials, SnowflakeConnector
 import snowflake.connector
 import base64
-from typing import Optional
+from cryptography.hazmat.primitives.serialization import load_der_private_key
+import contextvars
+import functools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Optional, Tuple
 
 
 def get_snowflake_connector(
@@ -31,36 +38,49 @@ def get_snowflake_connector(
     return connector
 
 
+@functools.lru_cache(maxsize=1)
+def _load_sf_credentials() -> Tuple[str, str, Optional[str], Any]:
+    """
+    Loads the Snowflake credentials block once and returns (user, account, role, private_key).
+    """
+    credentials = SnowflakeCredentials.load("snowflake-credentials-key-auth")
+
+    # Decode the private key from base64 to DER bytes
+    private_key_bytes = base64.b64decode(credentials.private_key.get_secret_value())
+
+    # Parse the DER key once; the connector accepts the key object and skips re-parsing it
+    private_key = load_der_private_key(private_key_bytes, password=None)
+
+    return credentials.user, credentials.account, credentials.role, private_key
+
+
 def get_snowflake_connection(
     warehouse: str = "PREFECT_WH",
     database: Optional[str] = "ai",
     schema: Optional[str] = "AGENTIC_DOC_EXTRACTION",
+    client_session_keep_alive: bool = False,
 ):
     """
     Establishes a connection to Snowflake and returns the connection object.
     """
     logger = get_run_logger()
 
-    connector = get_snowflake_connector(warehouse, database, schema)
-    credentials = connector.credentials
-
-    # Retrieve the base64-encoded private key
-    private_key_base64 = credentials.private_key.get_secret_value()
-
-    # Decode the private key from base64 to bytes
-    private_key_bytes = base64.b64decode(private_key_base64)
+    # Connect straight from the cached credentials; building a SnowflakeConnector
+    # block here would only reload the same credentials
+    user, account, role, private_key = _load_sf_credentials()
 
     # Create a Snowflake connection
     try:
         conn = snowflake.connector.connect(
-            user=credentials.user,
-            account=credentials.account,
-            role=credentials.role,
-            warehouse=connector.warehouse,
-            database=connector.database,
-            schema=connector.schema,
-            private_key=private_key_bytes,
+            user=user,
+            account=account,
+            role=role,
+            warehouse=warehouse,
+            database=database,
+            schema=schema,
+            private_key=private_key,
             autocommit=True,
+            client_session_keep_alive=client_session_keep_alive,
         )
         logger.info(
             f"✅ Successfully connected to Snowflake | Database: {database} | Schema: {schema} | Warehouse: {warehouse}"
@@ -69,3 +89,123 @@ def get_snowflake_connection(
     except Exception as e:
         logger.error(f"💩 Failed to connect to Snowflake: {e}")
         raise
+
+
+class SnowflakeConnectionPool:
+    """
+    Thread-safe pool of open Snowflake connections shared by concurrent tasks.
+
+    Connections are opened lazily up to `size` and returned to the pool after use
+    instead of being closed, so each one pays the auth/TLS handshake only once. They
+    keep their sessions alive, so a connection left idle through a long extraction
+    phase is still valid for the next load.
+    """
+
+    def __init__(
+        self, size: int, warehouse: str, database: Optional[str], schema: Optional[str]
+    ):
+        self.size = size
+        self._connect_args = (warehouse, database, schema)
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        # Connections open right now, idle or borrowed; only changed under the lock
+        self._open = 0
+        self._open_lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrows a connection, blocking while all `size` connections are in use.
+        """
+        with self._slots:
+            conn = self._take_idle() or self._connect()
+            try:
+                yield conn
+            finally:
+                if conn.is_closed():
+                    self._count_open(-1)
+                else:
+                    self._idle.put(conn)
+
+    def _connect(self):
+        self._count_open(1)
+        try:
+            return get_snowflake_connection(
+                *self._connect_args, client_session_keep_alive=True
+            )
+        except BaseException:
+            self._count_open(-1)
+            raise
+
+    def _count_open(self, delta: int) -> int:
+        with self._open_lock:
+            self._open += delta
+            return self._open
+
+    def _take_idle(self):
+        """
+        Returns an idle connection that is still open, discarding any that were closed.
+        """
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            if not conn.is_closed():
+                return conn
+            self._count_open(-1)
+
+    def prewarm(self, count: Optional[int] = None) -> None:
+        """
+        Opens connections in parallel, up to `count` open in total (idle or borrowed), so
+        the first tasks don't wait on handshakes.
+        """
+        missing = min(count or self.size, self.size) - self._count_open(0)
+        # Each connection being opened holds a slot, like a borrowed one, so prewarming
+        # alongside borrowers never takes the pool past `size`
+        slots = 0
+        while slots < missing and self._slots.acquire(blocking=False):
+            slots += 1
+        if not slots:
+            return
+        try:
+            # Each worker thread needs its own copy of the Prefect run context for logging
+            with ThreadPoolExecutor(max_workers=slots) as executor:
+                futures = [
+                    executor.submit(contextvars.copy_context().run, self._connect)
+                    for _ in range(slots)
+                ]
+            # Keep the connections that did open before re-raising the first failure
+            errors = [future.exception() for future in futures if future.exception()]
+            for future in futures:
+                if not future.exception():
+                    self._idle.put(future.result())
+            if errors:
+                raise errors[0]
+        finally:
+            for _ in range(slots):
+                self._slots.release()
+
+    def close_all(self) -> None:
+        """
+        Closes every idle connection; the pool reopens connections on the next use.
+        """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+            self._count_open(-1)
+
+
+@functools.lru_cache(maxsize=None)
+def get_snowflake_pool(
+    size: int = 8,
+    warehouse: str = "PREFECT_WH",
+    database: Optional[str] = "ai",
+    schema: Optional[str] = "AGENTIC_DOC_EXTRACTION",
+) -> SnowflakeConnectionPool:
+    """
+    Returns the process-wide connection pool for the given warehouse/database/schema.
+    """
+    return SnowflakeConnectionPool(size, warehouse, database, schema)
@@ -160,6 +160,10 @@ prefect server start &
 sleep 10  # Give Prefect more time to start
 print_success "Prefect server started"
 
+# Cap parallel Landing AI calls across all flow runs (tasks tagged "landing-ai")
+print_status "Creating Landing AI concurrency limit"
+prefect concurrency-limit create landing-ai 8 || print_info "Concurrency limit 'landing-ai' already exists"
+
 # Configure credentials and create blocks
 print_header "Configuring credentials and creating Prefect blocks"
 
@@ -0,0 +1,20 @@
+import logging
+import os
+import sys
+
+import pytest
+
+# The flows import each other as top-level modules, as they do when run from flows/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "flows"))
+
+import get_snowflake_connection  # noqa: E402
+import s3_to_snowflake  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def run_logger(monkeypatch):
+    """Stand in for Prefect's run logger, which needs an active flow or task run."""
+    logger = logging.getLogger("tests")
+    monkeypatch.setattr(s3_to_snowflake, "get_run_logger", lambda: logger)
+    monkeypatch.setattr(get_snowflake_connection, "get_run_logger", lambda: logger)
+    return logger
@@ -0,0 +1,95 @@
+import threading
+import time
+
+import pytest
+
+import get_snowflake_connection
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    """Connections opened through the pool, in order."""
+    connections = []
+
+    def connect(*args, **kwargs):
+        time.sleep(0.01)
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    monkeypatch.setattr(get_snowflake_connection, "get_snowflake_connection", connect)
+    return connections
+
+
+def _pool(size=2):
+    return get_snowflake_connection.SnowflakeConnectionPool(size, "WH", "DB", "SCHEMA")
+
+
+def test_pool_reuses_connections(opened):
+    pool = _pool()
+
+    for _ in range(3):
+        with pool.connection():
+            pass
+
+    assert len(opened) == 1
+
+
+def test_pool_replaces_closed_connections(opened):
+    pool = _pool()
+
+    with pool.connection() as conn:
+        conn.close()
+    with pool.connection() as conn:
+        pass
+
+    assert len(opened) == 2
+    assert conn is opened[1]
+    assert pool._open == 1
+
+
+def test_prewarm_counts_borrowed_connections(opened):
+    pool = _pool(size=2)
+
+    with pool.connection():
+        pool.prewarm(2)
+    pool.prewarm(2)
+
+    assert len(opened) == 2
+
+
+def test_prewarm_with_concurrent_borrowers_stays_within_size(opened):
+    pool = _pool(size=2)
+
+    def borrow():
+        with pool.connection():
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=borrow) for _ in range(6)]
+    threads.append(threading.Thread(target=pool.prewarm, args=(2,)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(opened) <= 2
+
+
+def test_close_all_closes_idle_connections(opened):
+    pool = _pool(size=2)
+    pool.prewarm()
+
+    pool.close_all()
+
+    assert all(conn.closed for conn in opened)
+    assert pool._open == 0
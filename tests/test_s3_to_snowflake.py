@@ -0,0 +1,161 @@
+import gzip
+from contextlib import contextmanager
+from unittest import mock
+
+import orjson
+import pytest
+
+import s3_to_snowflake
+
+
+def _page(*keys, prefixes=()):
+    return {
+        "Contents": [
+            {"Key": key, "Size": 3, "ETag": '"abc"', "LastModified": "2024-01-01"}
+            for key in keys
+        ],
+        "CommonPrefixes": [{"Prefix": prefix} for prefix in prefixes],
+    }
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    """Mock S3 client whose paginator serves `client.pages`, keyed by Prefix (None for the root)."""
+    client = mock.Mock()
+    client.pages = {}
+    client.get_paginator.return_value.paginate.side_effect = (
+        lambda **kwargs: client.pages.get(kwargs.get("Prefix"), [])
+    )
+    monkeypatch.setattr(s3_to_snowflake, "_get_s3_client", lambda: client)
+    return client
+
+
+def _listed_keys(*args, **kwargs):
+    return sorted(
+        file["Key"]
+        for page in s3_to_snowflake._list_s3_files(*args, **kwargs)
+        for file in page
+    )
+
+
+def _paginated_prefixes(s3_client):
+    paginate = s3_client.get_paginator.return_value.paginate
+    return sorted(
+        call.kwargs["Prefix"]
+        for call in paginate.call_args_list
+        if "Prefix" in call.kwargs
+    )
+
+
+def test_page_objects_includes_metadata():
+    page = _page("docs/a.pdf", "docs/")
+
+    assert s3_to_snowflake._page_objects(page) == [
+        {"Key": "docs/a.pdf", "Size": 3, "LastModified": "2024-01-01", "ETag": "abc"}
+    ]
+
+
+def test_list_s3_files_prefix_normalized(s3_client):
+    s3_client.pages["docs/"] = [_page("docs/a.pdf")]
+
+    assert _listed_keys("bucket", ["docs", "other/"]) == ["docs/a.pdf"]
+    assert _paginated_prefixes(s3_client) == ["docs/", "other/"]
+
+
+def test_list_s3_files_merges_prefixes(s3_client):
+    s3_client.pages["a/"] = [_page("a/1.pdf"), _page("a/2.pdf")]
+    s3_client.pages["b/"] = [_page("b/1.pdf")]
+
+    assert _listed_keys("bucket", ["a", "b"]) == ["a/1.pdf", "a/2.pdf", "b/1.pdf"]
+
+
+def test_list_s3_files_shards_by_top_level_prefix(s3_client):
+    s3_client.pages[None] = [_page("root.pdf", prefixes=["a/", "b/"])]
+    s3_client.pages["a/"] = [_page("a/1.pdf")]
+    s3_client.pages["b/"] = [_page("b/1.pdf")]
+
+    assert _listed_keys("bucket") == ["a/1.pdf", "b/1.pdf", "root.pdf"]
+    assert _paginated_prefixes(s3_client) == ["a/", "b/"]
+
+
+def test_list_s3_files_raises_listing_failure(s3_client):
+    s3_client.get_paginator.return_value.paginate.side_effect = RuntimeError("denied")
+
+    with pytest.raises(RuntimeError, match="denied"):
+        _listed_keys("bucket", ["docs"])
+
+
+def test_exec_sql_batch_one_round_trip():
+    cursor = mock.Mock()
+    cursor.nextset.side_effect = [True, True, None]
+
+    s3_to_snowflake._exec_sql_batch(cursor, ["SELECT 1", "SELECT 2", "SELECT 3"], "Run")
+
+    cursor.execute.assert_called_once_with(
+        "SELECT 1;\nSELECT 2;\nSELECT 3", num_statements=3
+    )
+    assert cursor.nextset.call_count == 3
+
+
+def test_exec_sql_batch_falls_back_to_single_statements():
+    cursor = mock.Mock()
+    cursor.execute.side_effect = [
+        RuntimeError("batch failed"),
+        None,
+        RuntimeError("bad"),
+        None,
+    ]
+
+    s3_to_snowflake._exec_sql_batch(cursor, ["SELECT 1", "SELECT 2", "SELECT 3"], "Run")
+
+    assert [call.args[0] for call in cursor.execute.call_args_list[1:]] == [
+        "SELECT 1",
+        "SELECT 2",
+        "SELECT 3",
+    ]
+
+
+@pytest.fixture
+def snowflake_cursor(monkeypatch):
+    cursor = mock.MagicMock()
+    cursor.nextset.return_value = None
+    conn = mock.MagicMock()
+    conn.cursor.return_value.__enter__.return_value = cursor
+
+    @contextmanager
+    def connection():
+        yield conn
+
+    pool = mock.Mock(connection=connection)
+    monkeypatch.setattr(s3_to_snowflake, "_snowflake_pool", lambda: pool)
+    return cursor
+
+
+@pytest.mark.parametrize(
+    "insert_only, statement", [(False, "MERGE INTO"), (True, "INSERT INTO")]
+)
+def test_bulk_load_stages_documents_in_two_round_trips(
+    snowflake_cursor, insert_only, statement
+):
+    results = [
+        (f"docs/{i}.pdf", f"etag{i}", {"data": {"markdown": "x"}}) for i in range(10)
+    ]
+
+    s3_to_snowflake.bulk_load_to_snowflake.fn(results, insert_only)
+
+    put, load = snowflake_cursor.execute.call_args_list
+    assert put.args[0].startswith("PUT file://")
+    staged = gzip.decompress(put.kwargs["file_stream"].getvalue()).splitlines()
+    assert [orjson.loads(line)["file_path"] for line in staged] == [
+        r[0] for r in results
+    ]
+    assert load.kwargs == {"num_statements": 3}
+    assert statement in load.args[0]
+
+
+def test_bulk_load_stages_copies_without_content(snowflake_cursor):
+    s3_to_snowflake.bulk_load_to_snowflake.fn([("docs/copy.pdf", "etag", None)])
+
+    put = snowflake_cursor.execute.call_args_list[0]
+    (record,) = gzip.decompress(put.kwargs["file_stream"].getvalue()).splitlines()
+    assert "extracted_content" not in orjson.loads(record)